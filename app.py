@@ -1,10 +1,28 @@
 import streamlit as st
-from serp_analyzer import SERPAnalyzer
+from serp_analyzer import SERPAnalyzer, _HLEVELS, flatten_result, get_search_provider
 import pandas as pd
-import json
+import asyncio
+import io
+import orjson
 import os
 from datetime import datetime
 
+@st.cache_resource
+def get_provider():
+    """Create the configured search provider once per app process"""
+    return get_search_provider()
+
+class NoURLsFound(Exception):
+    """Raised when a search returns no URLs, so the empty result isn't cached"""
+
+@st.cache_data(ttl=600, show_spinner=False)
+def get_urls(query, num_results):
+    """Fetch SERP URLs, reusing the result for the same query and count for 10 minutes"""
+    urls = get_provider().search(query, num_results)
+    if not urls:
+        raise NoURLsFound()
+    return urls
+
 # Set page config
 st.set_page_config(
     page_title="SERP Analyzer",
@@ -25,9 +43,13 @@ with st.sidebar:
     st.header("Settings")
     query = st.text_input("Search Query", placeholder="Enter your search query...")
     num_results = st.slider("Number of results", min_value=1, max_value=20, value=10)
-    delay = st.slider("Delay between requests (seconds)", min_value=1.0, max_value=5.0, value=2.0, step=0.5)
+    delay = st.slider("Delay between requests to the same host (seconds)", min_value=1.0, max_value=5.0, value=2.0, step=0.5)
+    export_excel = st.checkbox("Also export Excel (.xlsx)", value=False)
+    use_cache = st.checkbox("Use cache", value=True, help="Reuse pages downloaded in the last 24 hours")
     
     analyze_button = st.button("Analyze SERP", type="primary")
+    if st.button("Refresh SERP", help="Forget search results fetched in the last 10 minutes"):
+        get_urls.clear()
 
 # Main content area
 if analyze_button and query:
@@ -37,32 +59,38 @@ if analyze_button and query:
         status_text = st.empty()
         
         # Initialize analyzer
-        analyzer = SERPAnalyzer(query, num_results, delay)
+        analyzer = SERPAnalyzer(query, num_results, delay, use_cache=use_cache, provider=get_provider())
         
         # Get URLs
-        urls = analyzer.get_serp_urls()
-        if not urls:
+        try:
+            urls = get_urls(query, num_results)
+        except NoURLsFound:
             st.error("No URLs found. Please try a different query.")
             st.stop()
+        except Exception as e:
+            st.error(f"Error fetching SERP results: {e}")
+            st.stop()
             
         # Create expander for URLs
         with st.expander("Found URLs", expanded=False):
             for i, url in enumerate(urls, 1):
                 st.text(f"{i}. {url}")
         
-        # Analyze each URL
-        results = []
-        for i, url in enumerate(urls, 1):
-            # Update progress
-            progress = i / len(urls)
-            progress_bar.progress(progress)
-            status_text.text(f"Analyzing URL {i}/{len(urls)}: {url}")
-            
-            # Analyze URL
-            page_elements = analyzer.extract_page_elements(url)
-            if page_elements:
-                page_elements['rank'] = i
-                results.append(page_elements)
+        # Analyze all URLs concurrently, updating progress as each one finishes
+        async def analyze_urls():
+            results = []
+            done = 0
+            status_text.text(f"Analyzing {len(urls)} URLs...")
+            async for rank, page_elements in analyzer.iter_pages(urls):
+                done += 1
+                progress_bar.progress(done / len(urls))
+                status_text.text(f"Analyzed URL {done}/{len(urls)}: {urls[rank - 1]}")
+                if page_elements:
+                    page_elements['rank'] = rank
+                    results.append(page_elements)
+            return sorted(results, key=lambda r: r['rank'])
+        
+        results = asyncio.run(analyze_urls())
         
         # Clear progress indicators
         progress_bar.empty()
@@ -80,30 +108,30 @@ if analyze_button and query:
         # Save JSON
         json_filename = f"{query.replace(' ', '_')}_{timestamp}.json"
         json_path = os.path.join(output_dir, json_filename)
-        with open(json_path, 'w', encoding='utf-8') as f:
-            json.dump(results, f, indent=2, ensure_ascii=False)
+        with open(json_path, 'wb') as f:
+            f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
         
-        # Save Excel
-        excel_filename = f"{query.replace(' ', '_')}_{timestamp}.xlsx"
-        excel_path = os.path.join(output_dir, excel_filename)
+        # Prepare data for display and export
+        df = pd.DataFrame.from_records(flatten_result(result) for result in results)
         
-        # Prepare data for display and Excel
-        display_data = []
-        for result in results:
-            row = result.copy()
-            for key in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']:
-                row[key] = '\n'.join(row[key])
-            display_data.append(row)
+        # Build CSV in memory
+        csv_filename = f"{query.replace(' ', '_')}_{timestamp}.csv"
+        csv_buffer = io.BytesIO()
+        df.to_csv(csv_buffer, index=False, encoding="utf-8")
         
-        df = pd.DataFrame(display_data)
-        df.to_excel(excel_path, index=False)
+        # Save Excel only when requested
+        if export_excel:
+            excel_filename = f"{query.replace(' ', '_')}_{timestamp}.xlsx"
+            excel_path = os.path.join(output_dir, excel_filename)
+            with pd.ExcelWriter(excel_path, engine="xlsxwriter") as writer:
+                df.to_excel(writer, index=False, sheet_name="results")
         
         # Display results
         st.success("Analysis completed!")
         
         # Download buttons
-        col1, col2 = st.columns(2)
-        with col1:
+        columns = st.columns(3 if export_excel else 2)
+        with columns[0]:
             with open(json_path, 'rb') as f:
                 st.download_button(
                     label="Download JSON",
@@ -111,14 +139,22 @@ if analyze_button and query:
                     file_name=json_filename,
                     mime="application/json"
                 )
-        with col2:
-            with open(excel_path, 'rb') as f:
-                st.download_button(
-                    label="Download Excel",
-                    data=f,
-                    file_name=excel_filename,
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
+        with columns[1]:
+            st.download_button(
+                label="Download CSV",
+                data=csv_buffer.getvalue(),
+                file_name=csv_filename,
+                mime="text/csv"
+            )
+        if export_excel:
+            with columns[2]:
+                with open(excel_path, 'rb') as f:
+                    st.download_button(
+                        label="Download Excel",
+                        data=f,
+                        file_name=excel_filename,
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                    )
         
         # Display results in tabs
         tab1, tab2 = st.tabs(["📊 Overview", "📑 Detailed Results"])
@@ -145,7 +181,7 @@ if analyze_button and query:
                     st.write("**Meta Description:**", result['meta_description'])
                     
                     # Display headers
-                    for header in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']:
+                    for header in _HLEVELS:
                         if result[header]:
                             st.write(f"**{header.upper()}:**")
                             for h in result[header]:
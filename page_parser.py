@@ -0,0 +1,211 @@
+"""
+Page parsing for the SERP analyzer
+
+Kept free of heavy dependencies (pandas, httpx, googlesearch) so that
+parse worker processes start quickly.
+"""
+import codecs
+import copy
+from lxml import etree, html as lxhtml
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Final, Dict, Optional, Tuple
+import hashlib
+import orjson
+import os
+import re
+import threading
+
+_HLEVELS: Final[tuple] = ('h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+
+# Cheap byte scans used to skip heading levels a page doesn't contain
+_HLEVEL_PATTERNS: Final[tuple] = tuple(
+    (level, re.compile(rb"<%s[\s>]" % level.encode(), re.IGNORECASE)) for level in _HLEVELS
+)
+
+_WIDE_BOMS: Final[tuple] = (codecs.BOM_UTF32_LE, codecs.BOM_UTF32_BE, codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)
+
+@lru_cache(maxsize=None)
+def _ascii_compatible_encoding(encoding: str) -> bool:
+    """Check whether an encoding writes ASCII markup as plain ASCII bytes"""
+    try:
+        return '<h1>'.encode(encoding) == b'<h1>'
+    except (LookupError, UnicodeError):
+        return True
+
+def _ascii_compatible(content: bytes, encoding: Optional[str]) -> bool:
+    """Check whether tags in content can be found by scanning the raw bytes"""
+    if content.startswith(_WIDE_BOMS):
+        return False
+    return _ascii_compatible_encoding(encoding) if encoding else True
+
+@lru_cache(maxsize=None)
+def _build_xpath(levels: Tuple[str, ...]) -> etree.XPath:
+    """Compile a single-pass XPath for the title, meta description and the given heading levels"""
+    return etree.XPath(
+        "|".join(["//title", "//meta[@name='description' or @property='og:description']"]
+                 + [f"//{level}" for level in levels])
+    )
+
+_CHARSET_PATTERN = re.compile(r'charset=["\']?([\w.:-]+)', re.IGNORECASE)
+
+def _declared_encoding(headers: Dict) -> Optional[str]:
+    """Get the charset declared in a response's Content-Type header, if any"""
+    match = _CHARSET_PATTERN.search(headers.get('content-type', ''))
+    return match.group(1) if match else None
+
+@lru_cache(maxsize=None)
+def _html_parser(encoding: Optional[str]) -> Optional[lxhtml.HTMLParser]:
+    """Get an HTML parser for a declared encoding, or None to let lxml detect it"""
+    if not encoding:
+        return None
+    try:
+        return lxhtml.HTMLParser(encoding=encoding)
+    except LookupError:
+        return None
+
+def _normalize_text(text: str) -> str:
+    """Collapse runs of whitespace, including newlines, into single spaces"""
+    return ' '.join(text.split())
+
+# Bump when extraction changes so stale parse results are not reused
+_PARSER_VERSION: Final[str] = "3"
+
+# In-process memo of parse results, keyed by content hash only
+_PARSE_MEMO_SIZE: Final[int] = 128
+_parse_memo: "OrderedDict[str, Dict]" = OrderedDict()
+_parse_memo_lock = threading.Lock()
+
+def _content_hash(content: bytes, encoding: Optional[str] = None) -> str:
+    """Hash a page body together with its declared charset and the parser version"""
+    digest = hashlib.blake2b(content, digest_size=16)
+    digest.update(f"\0{encoding or ''}\0{_PARSER_VERSION}".encode('utf-8', 'ignore'))
+    return digest.hexdigest()
+
+def _parse_html(content: bytes, encoding: Optional[str] = None) -> Dict:
+    """
+    Extract title, meta description and headers from raw HTML
+    
+    Args:
+        content (bytes): Raw HTML of the page
+        encoding (str): Charset from the HTTP headers, or None to detect it from the document
+        
+    Returns:
+        dict: Dictionary containing extracted elements
+    """
+    elements = {'title': '', 'meta_description': ''}
+    elements.update((level, []) for level in _HLEVELS)
+    title = description = og_description = None
+    
+    # Decoding happens inside lxml, which is much cheaper than charset detection in Python
+    try:
+        doc = lxhtml.fromstring(content, parser=_html_parser(encoding))
+    except etree.ParserError:
+        # Empty or whitespace-only page, keep the empty fields
+        return elements
+    
+    if _ascii_compatible(content, encoding):
+        present = tuple(level for level, pattern in _HLEVEL_PATTERNS if pattern.search(content))
+    else:
+        # The byte scan can't see tags in e.g. UTF-16, so query every level
+        present = _HLEVELS
+    
+    # Nodes come back in document order, so the first match wins
+    for node in _build_xpath(present)(doc):
+        if node.tag == 'title':
+            if title is None:
+                title = _normalize_text(node.text_content())
+        elif node.tag == 'meta':
+            meta_content = (node.get('content') or '').strip()
+            if node.get('name') == 'description':
+                if description is None:
+                    description = meta_content
+            elif og_description is None:
+                og_description = meta_content
+        elif (text := _normalize_text(node.text_content())):
+            elements[node.tag].append(text)
+    
+    elements['title'] = title or ''
+    if description is not None:
+        elements['meta_description'] = description
+    else:
+        elements['meta_description'] = og_description or ''
+    
+    return elements
+
+def _parse_bytes(content_hash: str, content: bytes, encoding: Optional[str] = None,
+                 cache_dir: Optional[str] = None) -> Dict:
+    """
+    Extract elements from raw HTML, reusing earlier results for the same content
+    
+    Results are memoized in-process and, when cache_dir is given, stored on
+    disk as JSON keyed by content hash.
+    
+    Args:
+        content_hash (str): Result of _content_hash for content, used as the cache key
+        content (bytes): Raw HTML of the page
+        encoding (str): Charset from the HTTP headers, or None to detect it from the document
+        cache_dir (str): Directory for cached results, or None to skip the disk cache
+        
+    Returns:
+        dict: Dictionary containing extracted elements (shared, do not modify)
+    """
+    with _parse_memo_lock:
+        if content_hash in _parse_memo:
+            _parse_memo.move_to_end(content_hash)
+            return _parse_memo[content_hash]
+    
+    elements = None
+    cache_path = os.path.join(cache_dir, f"{content_hash}.json") if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                elements = orjson.loads(f.read())
+        except Exception:
+            pass
+    
+    if elements is None:
+        elements = _parse_html(content, encoding)
+        if cache_path:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                with open(cache_path, 'wb') as f:
+                    f.write(orjson.dumps(elements))
+            except Exception as e:
+                print(f"Error caching parsed page: {e}")
+    
+    with _parse_memo_lock:
+        _parse_memo[content_hash] = elements
+        if len(_parse_memo) > _PARSE_MEMO_SIZE:
+            _parse_memo.popitem(last=False)
+    
+    return elements
+
+def _extract_page_elements(url: str, content: bytes, encoding: Optional[str] = None,
+                           cache_dir: Optional[str] = None) -> Dict:
+    """
+    Extract HTML elements from a downloaded page
+    
+    Picklable by reference so it can run in a worker process.
+    
+    Args:
+        url (str): URL the page was downloaded from
+        content (bytes): Raw HTML of the page
+        encoding (str): Charset from the HTTP headers, or None to detect it from the document
+        cache_dir (str): Directory for cached parse results, or None to skip the disk cache
+        
+    Returns:
+        dict: Dictionary containing extracted elements, or None if parsing failed
+    """
+    try:
+        content_hash = _content_hash(content, encoding)
+        
+        # Copy so callers can modify the result without touching the cache
+        elements = {'url': url}
+        elements.update(copy.deepcopy(_parse_bytes(content_hash, content, encoding, cache_dir)))
+        
+        return elements
+        
+    except Exception as e:
+        print(f"Error analyzing {url}: {e}")
+        return None
@@ -1,87 +1,385 @@
-import requests
-from bs4 import BeautifulSoup
+from abc import ABC, abstractmethod
+import asyncio
 from googlesearch import search
+import httpx
 import pandas as pd
-from typing import List, Dict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import AsyncIterator, Final, List, Dict, Optional, Tuple
 from datetime import datetime
-import json
+import hashlib
+import multiprocessing
+import orjson
 import os
+import random
+import re
+import requests
+import threading
 import time
+from urllib.parse import urlsplit
+
+from page_parser import _HLEVELS, _declared_encoding, _extract_page_elements
+
+_HEADERS: Final[dict] = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+}
+
+# Pages are truncated after this many bytes; headings sit well before it in practice
+_MAX_BYTES: Final[int] = 1024 * 1024
+_CHUNK_SIZE: Final[int] = 32 * 1024
+_BODY_END_PATTERN = re.compile(rb"</body>", re.IGNORECASE)
+
+def flatten_result(result: Dict) -> Dict:
+    """Build a table row from a result, joining header lists into strings"""
+    return {
+        key: '\n'.join(value) if key in _HLEVELS else value
+        for key, value in result.items()
+    }
+
+# Shared parse worker pool, started on first use and reused across analyses
+_parse_pool: Optional[ProcessPoolExecutor] = None
+_parse_pool_lock = threading.Lock()
+
+# Windows can't wait on more than 61 worker processes
+_MAX_PARSE_WORKERS: Final[int] = 61
+
+def _get_parse_pool(num_pages: int) -> ProcessPoolExecutor:
+    """
+    Get the shared parse worker pool, starting it on first use
+    
+    Args:
+        num_pages (int): Expected number of pages per analysis, used to size a new pool
+    """
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            workers = max(1, min(os.cpu_count() or 1, num_pages, _MAX_PARSE_WORKERS))
+            # spawn rather than fork: the host process (e.g. Streamlit) is multithreaded
+            _parse_pool = ProcessPoolExecutor(max_workers=workers,
+                                              mp_context=multiprocessing.get_context("spawn"))
+        return _parse_pool
+
+def _reset_parse_pool(broken: ProcessPoolExecutor):
+    """Drop a broken parse pool so the next call starts a new one"""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is broken:
+            _parse_pool = None
+    broken.shutdown(wait=False)
+
+class SearchProvider(ABC):
+    """Base class for sources of SERP URLs"""
+
+    @abstractmethod
+    def search(self, query: str, num_results: int) -> List[str]:
+        """
+        Fetch result URLs for a query
+        
+        Args:
+            query (str): Search query
+            num_results (int): Number of results to return
+            
+        Returns:
+            list: Result URLs in ranking order
+        """
+
+class GoogleSearchProvider(SearchProvider):
+    """Scrapes Google results with the googlesearch library"""
+
+    def search(self, query: str, num_results: int) -> List[str]:
+        return list(search(query, num_results=num_results, lang="en"))
+
+class SerpApiProvider(SearchProvider):
+    """Fetches Google results as JSON from SerpAPI"""
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+
+    def search(self, query: str, num_results: int) -> List[str]:
+        params = {'engine': 'google', 'q': query, 'num': num_results, 'hl': 'en', 'api_key': self.api_key}
+        resp = requests.get("https://serpapi.com/search.json", params=params, timeout=10)
+        resp.raise_for_status()
+        return [r['link'] for r in resp.json().get('organic_results', [])[:num_results]]
+
+class SearxProvider(SearchProvider):
+    """Fetches results as JSON from a SearxNG instance"""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip('/')
+
+    def search(self, query: str, num_results: int) -> List[str]:
+        params = {'q': query, 'format': 'json', 'language': 'en'}
+        resp = requests.get(f"{self.base_url}/search", params=params, headers=_HEADERS, timeout=10)
+        resp.raise_for_status()
+        return [r['url'] for r in resp.json().get('results', [])[:num_results]]
+
+def _required_env(var: str, provider: str) -> str:
+    """Read an environment variable a search provider needs"""
+    value = os.environ.get(var, '').strip()
+    if not value:
+        raise ValueError(f"SERP_PROVIDER={provider} requires the {var} environment variable to be set")
+    return value
+
+def get_search_provider() -> SearchProvider:
+    """
+    Create the search provider selected by the SERP_PROVIDER environment variable
+    
+    Supported values are "google" (default), "serpapi" (requires SERPAPI_API_KEY)
+    and "searx" (requires SEARX_URL).
+    """
+    name = os.environ.get('SERP_PROVIDER', 'google').strip().lower()
+    if name == 'serpapi':
+        return SerpApiProvider(_required_env('SERPAPI_API_KEY', name))
+    if name == 'searx':
+        return SearxProvider(_required_env('SEARX_URL', name))
+    if name == 'google':
+        return GoogleSearchProvider()
+    raise ValueError(f"Unknown SERP_PROVIDER: {name}")
 
 class SERPAnalyzer:
-    def __init__(self, query: str, num_results: int = 10, delay: float = 2.0):
+    # Cached responses older than this are fetched again
+    CACHE_TTL = 24 * 60 * 60
+
+    def __init__(self, query: str, num_results: int = 10, delay: float = 2.0, concurrency: int = 5,
+                 use_cache: bool = True, cache_dir: str = "cache", provider: Optional[SearchProvider] = None):
         """
         Initialize the SERP analyzer
         
         Args:
             query (str): Search query to analyze
             num_results (int): Number of results to fetch (default: 10)
-            delay (float): Delay between requests in seconds (default: 2.0)
+            delay (float): Approximate delay between requests to the same host in seconds (default: 2.0)
+            concurrency (int): Maximum number of pages fetched at once (default: 5)
+            use_cache (bool): Reuse previously downloaded pages (default: True)
+            cache_dir (str): Directory for cached pages (default: "cache")
+            provider (SearchProvider): Source of SERP URLs (default: chosen by SERP_PROVIDER)
         """
         self.query = query
         self.num_results = num_results
         self.delay = delay
+        self._host_next_request = {}
+        self.concurrency = concurrency
+        self.use_cache = use_cache
+        self.cache_dir = cache_dir
+        self.provider = provider or get_search_provider()
         self.results = []
+        self._client = None
+        
+        if self.use_cache:
+            self._prune_cache()
+
+    async def __aenter__(self):
+        """Open a pooled HTTP/2 client shared by all page requests"""
+        limits = httpx.Limits(max_connections=self.num_results, max_keepalive_connections=self.num_results)
+        self._client = httpx.AsyncClient(http2=True, headers=_HEADERS, timeout=10,
+                                         follow_redirects=True, limits=limits)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        """Close the shared HTTP client"""
+        await self._client.aclose()
+        self._client = None
         
     def get_serp_urls(self) -> List[str]:
-        """Fetch URLs from Google SERP"""
+        """Fetch URLs from the configured search provider"""
         try:
-            results_generator = search(self.query, num_results=self.num_results, lang="en")
-            return list(results_generator)
+            return self.provider.search(self.query, self.num_results)
         except Exception as e:
             print(f"Error fetching SERP results: {e}")
             return []
 
-    def extract_page_elements(self, url: str) -> Dict:
+    async def _fetch_page(self, semaphore: asyncio.Semaphore, url: str) -> Optional[Tuple[bytes, Optional[str]]]:
         """
-        Extract HTML elements from a given URL
+        Download the raw HTML of a given URL
         
         Args:
-            url (str): URL to analyze
+            semaphore (asyncio.Semaphore): Limits the number of concurrent requests
+            url (str): URL to download
             
         Returns:
-            dict: Dictionary containing extracted elements
+            tuple: Response body and its declared charset, or None if the request failed
         """
-        try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-                'Accept-Language': 'en-US,en;q=0.5',
-            }
-            
-            # Add delay between requests
-            time.sleep(self.delay)
-            
-            page = requests.get(url, headers=headers, timeout=10)
-            soup = BeautifulSoup(page.text, "html.parser")
+        if self.use_cache:
+            cached = self._load_cached_page(url)
+            if cached is not None:
+                return cached
+        
+        # Wait for this host's turn before taking a download slot
+        await asyncio.sleep(self._host_wait(url))
+        
+        async with semaphore:
+            try:
+                async with self._client.stream('GET', url) as page:
+                    content = await self._read_body(page)
+                    
+                headers = dict(page.headers)
+                if self.use_cache and page.status_code < 400:
+                    self._store_cached_page(url, page.status_code, headers, content)
+                return content, _declared_encoding(headers)
+                    
+            except Exception as e:
+                print(f"Error fetching {url}: {e}")
+                return None
+
+    def _host_wait(self, url: str) -> float:
+        """
+        Reserve the next request time for a URL's host
+        
+        The first request to a host goes out immediately; repeat requests are
+        spaced by a jittered delay.
+        
+        Args:
+            url (str): URL about to be requested
             
-            # Extract elements
-            elements = {
-                'url': url,
-                'title': self._get_text(soup.find('title')),
-                'meta_description': self._get_meta_description(soup),
-                'h1': [h.get_text(strip=True) for h in soup.find_all('h1') if h.get_text(strip=True)],
-                'h2': [h.get_text(strip=True) for h in soup.find_all('h2') if h.get_text(strip=True)],
-                'h3': [h.get_text(strip=True) for h in soup.find_all('h3') if h.get_text(strip=True)],
-                'h4': [h.get_text(strip=True) for h in soup.find_all('h4') if h.get_text(strip=True)],
-                'h5': [h.get_text(strip=True) for h in soup.find_all('h5') if h.get_text(strip=True)],
-                'h6': [h.get_text(strip=True) for h in soup.find_all('h6') if h.get_text(strip=True)]
-            }
+        Returns:
+            float: Seconds to wait before sending the request
+        """
+        host = urlsplit(url).netloc.lower()
+        now = time.monotonic()
+        start = max(now, self._host_next_request.get(host, now))
+        self._host_next_request[host] = start + random.uniform(self.delay / 2, self.delay)
+        return start - now
+
+    async def _read_body(self, page: httpx.Response) -> bytes:
+        """Read a response body, stopping at </body> or after _MAX_BYTES"""
+        buf = bytearray()
+        async for chunk in page.aiter_bytes(_CHUNK_SIZE):
+            # Only search the new data, plus enough overlap for a split tag
+            start = max(0, len(buf) - len(b"</body>"))
+            buf += chunk
+            if len(buf) >= _MAX_BYTES or _BODY_END_PATTERN.search(buf, start):
+                break
+        return bytes(buf)
+
+    def _cache_paths(self, url: str) -> Tuple[str, str]:
+        """Get the cached body and metadata file paths for a URL"""
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        base = os.path.join(self.cache_dir, key)
+        return f"{base}.body", f"{base}.meta.json"
+
+    def _load_cached_page(self, url: str) -> Optional[Tuple[bytes, Optional[str]]]:
+        """Return the cached body and charset for a URL, or None if missing or expired"""
+        body_path, meta_path = self._cache_paths(url)
+        try:
+            if time.time() - os.path.getmtime(meta_path) > self.CACHE_TTL:
+                for path in (body_path, meta_path):
+                    os.remove(path)
+                return None
+            with open(meta_path, 'rb') as f:
+                meta = orjson.loads(f.read())
+            with open(body_path, 'rb') as f:
+                content = f.read()
+            return content, _declared_encoding(meta['headers'])
+        except Exception:
+            return None
+
+    def _store_cached_page(self, url: str, status: int, headers: Dict, content: bytes):
+        """Store a downloaded response in the cache"""
+        body_path, meta_path = self._cache_paths(url)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(body_path, 'wb') as f:
+                f.write(content)
+            # Written last, so a metadata file means the body is complete
+            with open(meta_path, 'wb') as f:
+                f.write(orjson.dumps({'status': status, 'headers': headers}))
+        except Exception as e:
+            print(f"Error caching {url}: {e}")
+
+    def _prune_cache(self):
+        """Delete cached pages and parse results older than CACHE_TTL"""
+        cutoff = time.time() - self.CACHE_TTL
+        for directory in (self.cache_dir, self._parsed_cache_dir()):
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_file() and entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                except OSError:
+                    pass
+
+    async def iter_pages(self, urls: List[str]) -> AsyncIterator[Tuple[int, Optional[Dict]]]:
+        """
+        Download and analyze URLs concurrently, yielding each one as it finishes
+        
+        Args:
+            urls (List[str]): URLs to analyze
             
-            return elements
+        Yields:
+            tuple: 1-based rank of the URL and its extracted elements (None for failures)
+        """
+        if not urls:
+            return
+        
+        # Reuse the caller's client when used as "async with analyzer:"
+        if self._client is None:
+            async with self:
+                async for page in self.iter_pages(urls):
+                    yield page
+            return
+        
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        cache_dir = self._parsed_cache_dir()
+        
+        # Parsing is CPU-bound, so spread it across cores
+        executor = _get_parse_pool(max(len(urls), self.num_results))
+        
+        async def analyze(rank: int, url: str) -> Tuple[int, Optional[Dict]]:
+            page = await self._fetch_page(semaphore, url)
+            if page is None:
+                return rank, None
+            content, encoding = page
+            # Parse off the event loop so it overlaps with in-flight downloads
+            try:
+                elements = await loop.run_in_executor(executor, _extract_page_elements,
+                                                      url, content, encoding, cache_dir)
+            except BrokenProcessPool:
+                # A worker died; start a fresh pool next time and parse this page here
+                _reset_parse_pool(executor)
+                elements = _extract_page_elements(url, content, encoding, cache_dir)
+            return rank, elements
+        
+        for future in asyncio.as_completed([analyze(rank, url) for rank, url in enumerate(urls, 1)]):
+            yield await future
+
+    async def fetch_all(self, urls: List[str]) -> List[Optional[Dict]]:
+        """
+        Download and analyze URLs concurrently
+        
+        Args:
+            urls (List[str]): URLs to analyze
             
-        except Exception as e:
-            print(f"Error analyzing {url}: {e}")
-            return None
+        Returns:
+            list: Extracted elements for each URL, in input order (None for failures)
+        """
+        pages = [None] * len(urls)
+        async for rank, page_elements in self.iter_pages(urls):
+            pages[rank - 1] = page_elements
+        return pages
 
-    def _get_text(self, element) -> str:
-        """Safely extract text from a BS4 element"""
-        return element.get_text(strip=True) if element else ''
+    def extract_page_elements(self, url: str, content: bytes, encoding: Optional[str] = None) -> Dict:
+        """
+        Extract HTML elements from a downloaded page
+        
+        Args:
+            url (str): URL the page was downloaded from
+            content (bytes): Raw HTML of the page
+            encoding (str): Charset from the HTTP headers, or None to detect it from the document
+            
+        Returns:
+            dict: Dictionary containing extracted elements
+        """
+        return _extract_page_elements(url, content, encoding, self._parsed_cache_dir())
 
-    def _get_meta_description(self, soup) -> str:
-        """Extract meta description from soup"""
-        meta = soup.find('meta', attrs={'name': 'description'}) or soup.find('meta', attrs={'property': 'og:description'})
-        return meta.get('content', '').strip() if meta else ''
+    def _parsed_cache_dir(self) -> Optional[str]:
+        """Directory for cached parse results, or None when caching is disabled"""
+        return os.path.join(self.cache_dir, "parsed") if self.use_cache else None
 
     def analyze_serp(self) -> List[Dict]:
         """Analyze all SERP results"""
@@ -91,9 +389,10 @@ class SERPAnalyzer:
         print(f"\nFound {len(urls)} URLs to analyze")
         print("Starting analysis (this may take a few minutes)...\n")
         
-        for i, url in enumerate(urls, 1):
-            print(f"[{i}/{len(urls)}] Analyzing: {url}")
-            page_elements = self.extract_page_elements(url)
+        pages = asyncio.run(self.fetch_all(urls))
+        
+        for i, (url, page_elements) in enumerate(zip(urls, pages), 1):
+            print(f"[{i}/{len(urls)}] Analyzed: {url}")
             if page_elements:
                 page_elements['rank'] = i
                 results.append(page_elements)
@@ -104,12 +403,14 @@ class SERPAnalyzer:
         self.results = results
         return results
 
-    def save_results(self, output_dir: str = "output"):
+    def save_results(self, output_dir: str = "output", formats: Tuple[str, ...] = ("json", "csv")):
         """
-        Save results to JSON and Excel files
+        Save results to JSON, CSV and/or Excel files
         
         Args:
             output_dir (str): Directory to save results
+            formats (tuple): Output formats to write, any of "json", "csv" and "xlsx"
+                (default: ("json", "csv"))
         """
         if not self.results:
             print("No results to save")
@@ -121,29 +422,34 @@ class SERPAnalyzer:
         # Generate filename with timestamp
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         base_filename = f"{self.query.replace(' ', '_')}_{timestamp}"
+        saved = []
         
         # Save as JSON
-        json_path = os.path.join(output_dir, f"{base_filename}.json")
-        with open(json_path, 'w', encoding='utf-8') as f:
-            json.dump(self.results, f, indent=2, ensure_ascii=False)
-        
-        # Save as Excel
-        excel_path = os.path.join(output_dir, f"{base_filename}.xlsx")
-        
-        # Convert nested lists to strings for Excel
-        excel_data = []
-        for result in self.results:
-            row = result.copy()
-            for key in ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']:
-                row[key] = '\n'.join(row[key])
-            excel_data.append(row)
+        if "json" in formats:
+            json_path = os.path.join(output_dir, f"{base_filename}.json")
+            with open(json_path, 'wb') as f:
+                f.write(orjson.dumps(self.results, option=orjson.OPT_INDENT_2))
+            saved.append(("JSON", json_path))
+        
+        if "csv" in formats or "xlsx" in formats:
+            df = pd.DataFrame.from_records(flatten_result(result) for result in self.results)
             
-        df = pd.DataFrame(excel_data)
-        df.to_excel(excel_path, index=False)
+            # Save as CSV
+            if "csv" in formats:
+                csv_path = os.path.join(output_dir, f"{base_filename}.csv")
+                df.to_csv(csv_path, index=False, encoding="utf-8")
+                saved.append(("CSV", csv_path))
+            
+            # Save as Excel (slow, so only on request)
+            if "xlsx" in formats:
+                excel_path = os.path.join(output_dir, f"{base_filename}.xlsx")
+                with pd.ExcelWriter(excel_path, engine="xlsxwriter") as writer:
+                    df.to_excel(writer, index=False, sheet_name="results")
+                saved.append(("Excel", excel_path))
         
         print(f"\nResults saved to:")
-        print(f"- JSON: {json_path}")
-        print(f"- Excel: {excel_path}")
+        for label, path in saved:
+            print(f"- {label}: {path}")
 
 def main():
     print("SERP Analyzer - Extract headers from top Google search results")
@@ -164,13 +470,17 @@ def main():
         print("Invalid input, using default: 10")
         num_results = 10
     
+    formats = ("json", "csv")
+    if input("Also export Excel (.xlsx)? [y/N]: ").strip().lower() in ("y", "yes"):
+        formats += ("xlsx",)
+    
     # Create analyzer and run analysis
     analyzer = SERPAnalyzer(query, num_results)
     analyzer.analyze_serp()
     
     # Save results
     output_dir = os.path.join(os.path.dirname(__file__), "output")
-    analyzer.save_results(output_dir)
+    analyzer.save_results(output_dir, formats)
 
 if __name__ == "__main__":
     main()